@@ -9,19 +9,14 @@ class Sketch(FlowSpec):
 
     @step
     def start(self):
-        """Load the dataset and start the pipeline."""
-        self.next(self.cross_validation, self.transform)
+        """Load and transform the dataset, and start the pipeline."""
+        self.next(self.cross_validation, self.train)
 
     @step
     def cross_validation(self):
-        """Split the dataset into folds for cross-validation."""
-        self.folds = [[0], [1], [2]]
-        self.next(self.transform_fold, foreach="folds")
-
-    @step
-    def transform_fold(self):
-        """Transform the dataset for the current fold."""
-        self.next(self.train_fold)
+        """Split the dataset into folds and transform the data of every fold."""
+        self.folds = [0, 1, 2]
+        self.next(self.train_fold, foreach="folds")
 
     @step
     def train_fold(self):
@@ -36,20 +31,15 @@ class Sketch(FlowSpec):
     @step
     def average_scores(self, inputs):
         """Average the evaluation scores from all folds."""
-        self.next(self.register_model)
-
-    @step
-    def transform(self):
-        """Transform the entire dataset for training."""
-        self.next(self.train_model)
+        self.next(self.register)
 
     @step
-    def train_model(self):
+    def train(self):
         """Train the model on the entire dataset."""
-        self.next(self.register_model)
+        self.next(self.register)
 
     @step
-    def register_model(self, inputs):
+    def register(self, inputs):
         """Register the model in the model registry."""
         self.next(self.end)
 
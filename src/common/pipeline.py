@@ -149,6 +149,11 @@ def parse_project_configuration(x):
     if "backend" not in config:
         config["backend"] = {"module": "backend.Local"}
 
+    # If the configuration doesn't specify the number of GPUs, we'll train the
+    # model using the CPU.
+    if "gpu" not in config:
+        config["gpu"] = 0
+
     # This regex matches any environment variable in the format ${ENVIRONMENT_VARIABLE}
     pattern = re.compile(r"\$\{(\w+)\}")
 
@@ -4,15 +4,17 @@ from pathlib import Path
 from metaflow import (
     Parameter,
     card,
+    config_expr,
     current,
     environment,
+    resources,
     step,
 )
 
 from common.pipeline import Pipeline, dataset
 
 environment_variables = {
-    "KERAS_BACKEND": os.getenv("KERAS_BACKEND", "tensorflow"),
+    "KERAS_BACKEND": os.getenv("KERAS_BACKEND", "jax"),
 }
 
 
@@ -67,6 +69,86 @@ def build_target_transformer():
     )
 
 
+def transform_data(data, features_transformer, target_transformer):
+    """Fit the transformation pipelines and use them to transform the data.
+
+    This function receives the unfitted features and target transformers and returns
+    a tuple with the fitted transformers, and the transformed features and targets.
+    The pipeline caches the results of this function, so it shouldn't call any other
+    function from this module.
+    """
+    import numpy as np
+
+    # Let's fit the SciKit-Learn pipelines and transform the dataset features and
+    # the target column.
+    x = features_transformer.fit_transform(data)
+    y = target_transformer.fit_transform(data)
+
+    # The transformers return 64-bit floats, but we don't need double precision to
+    # train the model. Using 32-bit features and integer labels halves the memory we
+    # need to store and move the data.
+    x = x.astype(np.float32, copy=False)
+    y = y.astype(np.int32, copy=False)
+
+    return features_transformer, target_transformer, x, y
+
+
+def split_fold(permutation, boundaries, fold):
+    """Return the training and test indices of a cross-validation fold.
+
+    The test indices of a fold are the slice of the permutation between the
+    boundaries of the fold, and the training indices are the rest of the permutation.
+    """
+    import numpy as np
+
+    start, stop = boundaries[fold], boundaries[fold + 1]
+    train_indices = np.concatenate([permutation[:start], permutation[stop:]])
+    test_indices = permutation[start:stop]
+
+    return train_indices, test_indices
+
+
+def transform_fold_data(
+    data,
+    train_indices,
+    test_indices,
+    features_transformer,
+    target_transformer,
+):
+    """Transform the training and test data corresponding to a single fold.
+
+    This function fits the unfitted transformation pipelines using the training data
+    of the fold and uses them to transform both the training and test data. It
+    returns a tuple with the transformed training and test features and targets.
+    The pipeline caches the results of this function, so it shouldn't call any other
+    function from this module.
+    """
+    import numpy as np
+
+    # We can use the indices to split the data into training and test sets.
+    train_data = data.iloc[train_indices]
+    test_data = data.iloc[test_indices]
+
+    # Let's fit the SciKit-Learn pipeline that processes the feature columns to the
+    # training data and transform both the training and test data.
+    x_train = features_transformer.fit_transform(train_data)
+    x_test = features_transformer.transform(test_data)
+
+    # Finally, we can fit the SciKit-Learn pipeline that processes the target column
+    # and transform both the training and test data.
+    y_train = target_transformer.fit_transform(train_data)
+    y_test = target_transformer.transform(test_data)
+
+    # Just like we do with the entire dataset, we'll use 32-bit features and
+    # integer labels to train and evaluate the model.
+    x_train = x_train.astype(np.float32, copy=False)
+    x_test = x_test.astype(np.float32, copy=False)
+    y_train = y_train.astype(np.int32, copy=False)
+    y_test = y_test.astype(np.int32, copy=False)
+
+    return x_train, y_train, x_test, y_test
+
+
 def build_model(input_shape, learning_rate=0.01):
     """Build and compile the neural network to predict the species of a penguin."""
     from keras import Input, layers, models, optimizers
@@ -80,15 +162,33 @@ def build_model(input_shape, learning_rate=0.01):
         ],
     )
 
+    # We want to compile the training and evaluation steps using XLA. This fuses the
+    # forward pass, the backward pass, and the optimizer update into a single
+    # compiled function that we'll reuse for every batch.
     model.compile(
         optimizer=optimizers.SGD(learning_rate=learning_rate),
         loss="sparse_categorical_crossentropy",
         metrics=["accuracy"],
+        jit_compile=True,
     )
 
     return model
 
 
+def get_training_device():
+    """Return the name of the device Keras will use to train the model.
+
+    Keras can only list the available devices when using the JAX or TensorFlow
+    backends, so this function returns `None` when using any other backend.
+    """
+    from keras import backend, distribution
+
+    if backend.backend() not in ("jax", "tensorflow"):
+        return None
+
+    return distribution.list_devices()[0]
+
+
 class Training(Pipeline):
     """Training pipeline.
 
@@ -108,6 +208,38 @@ class Training(Pipeline):
         default=32,
     )
 
+    transformers_cache = Parameter(
+        "transformers-cache",
+        help=(
+            "Directory used to cache the results of the transformation process when "
+            "running in development mode, for example `.cache/transformers`. Caching "
+            "is disabled when this parameter is empty or when running in production "
+            "mode."
+        ),
+        default="",
+    )
+
+    leak_ok = Parameter(
+        "leak-ok",
+        help=(
+            "Whether to fit the transformation pipelines once on the entire dataset "
+            "and reuse the transformed data for every cross-validation fold. This is "
+            "faster, but it leaks statistics from the test data of each fold, like "
+            "the mean used to scale numeric columns, into the training process."
+        ),
+        default=False,
+    )
+
+    quantize = Parameter(
+        "quantize",
+        help=(
+            "Whether to quantize the weights of the model to int8 before registering "
+            "it. This reduces the size of the model and the cost of inference at the "
+            "expense of a small loss in precision."
+        ),
+        default=False,
+    )
+
     accuracy_threshold = Parameter(
         "accuracy-threshold",
         help="Minimum accuracy threshold required to register the model.",
@@ -118,7 +250,12 @@ class Training(Pipeline):
     @card
     @step
     def start(self):
-        """Start and prepare the Training pipeline."""
+        """Start and prepare the Training pipeline.
+
+        This step also applies the transformation pipelines to the entire dataset. We
+        want to store the transformers as artifacts so we can later use them to
+        transform the input data during inference.
+        """
         import mlflow
 
         self.logger.info("MLflow tracking server: %s", self.mlflow_tracking_uri)
@@ -136,61 +273,87 @@ class Training(Pipeline):
             message = f"Failed to connect to MLflow server {self.mlflow_tracking_uri}."
             raise RuntimeError(message) from e
 
+        # We'll use the entire dataset to build the final model, so let's fit the
+        # SciKit-Learn pipelines and transform the dataset. If we already transformed
+        # the same data with the same transformers, we'll load the results from the
+        # cache.
+        transform = self._get_transformers_cache().cache(transform_data)
+        self.features_transformer, self.target_transformer, self.x, self.y = transform(
+            self.data,
+            build_features_transformer(),
+            build_target_transformer(),
+        )
+
         # Now that everything is set up, we want to run a cross-validation process
         # to evaluate the model and train a final model on the entire dataset. Since
         # these two steps are independent, we can run them in parallel.
-        self.next(self.cross_validation, self.transform)
+        self.next(self.cross_validation, self.train)
 
     @card
     @step
     def cross_validation(self):
-        """Generate the indices to split the data for the cross-validation process."""
-        from sklearn.model_selection import KFold
-
-        # We are going to use a 5-fold cross-validation process. We'll shuffle the data
-        # before splitting it into batches.
-        kfold = KFold(n_splits=5, shuffle=True)
-
-        # We can now generate the indices to split the dataset into training and test
-        # sets. This will return a tuple with the fold number and the training and test
-        # indices for each of 5 folds.
-        self.folds = list(enumerate(kfold.split(self.data)))
+        """Generate the cross-validation folds and transform the data for each one.
 
-        # We can use a `foreach` to run every fold on a separate branch. Notice how we
-        # pass the tuple with the fold number and the indices to next step.
-        self.next(self.transform_fold, foreach="folds")
+        Transforming the data of a fold is cheap compared to the cost of starting a
+        separate task, so we transform every fold in parallel inside this step and
+        only branch out to train and evaluate each model.
+        """
+        import numpy as np
+        from joblib import Parallel, delayed
+
+        # We are going to use a 5-fold cross-validation process. Instead of storing the
+        # training and test indices of every fold, we'll store a single shuffled
+        # permutation of the dataset and the boundaries of the test data of every fold
+        # in that permutation. When we cache the transformation process, we want to
+        # generate the same folds every time so we can reuse the cached results.
+        cache = self._get_transformers_cache()
+        generator = np.random.default_rng(None if cache.location is None else 42)
+        self.fold_permutation = generator.permutation(len(self.data)).astype(np.int32)
+        self.fold_boundaries = np.linspace(0, len(self.data), 6, dtype=np.int32)
+
+        # We'll use the list of fold numbers to create a branch for each fold.
+        self.folds = list(range(len(self.fold_boundaries) - 1))
+        splits = [
+            split_fold(self.fold_permutation, self.fold_boundaries, fold)
+            for fold in self.folds
+        ]
 
-    @step
-    def transform_fold(self):
-        """Transform the data to build a model during the cross-validation process.
+        if self.leak_ok:
+            # If we are fine leaking statistics from the test data, we can reuse the
+            # dataset we transformed at the start of the flow and slice it for every
+            # fold.
+            self.logger.info("Slicing transformed dataset for %d folds...", len(splits))
+            self.fold_data = [
+                (
+                    self.x[train_indices],
+                    self.y[train_indices],
+                    self.x[test_indices],
+                    self.y[test_indices],
+                )
+                for train_indices, test_indices in splits
+            ]
+        else:
+            # Let's transform the training and test data of every fold using a separate
+            # worker for each one of them. The result is a list with the transformed
+            # training and test data, in the same order as the list of folds. If we
+            # already transformed a fold using the same data, we'll load it from the
+            # cache.
+            self.logger.info("Transforming %d folds...", len(self.folds))
+            transform = cache.cache(transform_fold_data)
+            self.fold_data = Parallel(n_jobs=len(self.folds), backend="loky")(
+                delayed(transform)(
+                    self.data,
+                    train_indices,
+                    test_indices,
+                    build_features_transformer(),
+                    build_target_transformer(),
+                )
+                for train_indices, test_indices in splits
+            )
 
-        This step will run for each fold in the cross-validation process. It uses
-        a SciKit-Learn pipeline to preprocess the dataset before training a model.
-        """
-        # Let's start by unpacking the indices representing the training and test data
-        # for the current fold.
-        self.fold, (self.train_indices, self.test_indices) = self.input
-        self.logger.info("Transforming fold %d...", self.fold)
-
-        # We can use the indices to split the data into training and test sets.
-        train_data = self.data.iloc[self.train_indices]
-        test_data = self.data.iloc[self.test_indices]
-
-        # Let's build the SciKit-Learn pipeline to process the feature columns,
-        # fit it to the training data and transform both the training and test data.
-        features_transformer = build_features_transformer()
-        self.x_train = features_transformer.fit_transform(train_data)
-        self.x_test = features_transformer.transform(test_data)
-
-        # Finally, we can build the SciKit-Learn pipeline to process the target column,
-        # fit it to the training data and transform both the training and test data.
-        target_transformer = build_target_transformer()
-        self.y_train = target_transformer.fit_transform(train_data)
-        self.y_test = target_transformer.transform(test_data)
-
-        # After processing the data and storing it as artifacts in the flow, we can move
-        # to the training step.
-        self.next(self.train_fold)
+        # We can use a `foreach` to train every fold on a separate branch. Notice how
+        # we pass the fold number to the next step.
+        self.next(self.train_fold, foreach="folds")
 
     @card
     @environment(vars=environment_variables)
@@ -199,9 +362,21 @@ class Training(Pipeline):
         """Train a model as part of the cross-validation process.
 
         This step will run for each fold in the cross-validation process. It trains the
-        model using the data we processed in the previous step.
+        model using the data we transformed for the fold in the previous step.
         """
+        import time
+
         import mlflow
+        from mlflow import MlflowClient
+        from mlflow.entities import Metric, Param
+
+        # Let's start by computing the indices representing the training and test data
+        # for the current fold, and retrieving the data we transformed for it.
+        self.fold = self.input
+        self.train_indices, self.test_indices = split_fold(
+            self.fold_permutation, self.fold_boundaries, self.fold
+        )
+        self.x_train, self.y_train, self.x_test, self.y_test = self.fold_data[self.fold]
 
         self.logger.info("Training fold %d...", self.fold)
 
@@ -219,10 +394,6 @@ class Training(Pipeline):
             # reuse it later when we evaluate the model.
             self.mlflow_fold_run_id = run.info.run_id
 
-            # We are currently training a model corresponding to an individual fold,
-            # so we don't want to log that model because it's useless.
-            mlflow.autolog(log_models=False)
-
             # Let's now build and fit the model on the training data we processed in the
             # previous step.
             self.model = build_model(self.x_train.shape[1])
@@ -234,6 +405,24 @@ class Training(Pipeline):
                 verbose=0,
             )
 
+            # We are currently training a model corresponding to an individual fold,
+            # so we don't want to use MLflow's automatic logging because it would send
+            # a separate request after every epoch. We don't need epoch-level tracking
+            # for these models, so we'll log the training parameters and the final
+            # value of every metric in a single request.
+            timestamp = int(time.time() * 1000)
+            MlflowClient().log_batch(
+                run_id=self.mlflow_fold_run_id,
+                metrics=[
+                    Metric(key=key, value=values[-1], timestamp=timestamp, step=0)
+                    for key, values in history.history.items()
+                ],
+                params=[
+                    Param("epochs", str(self.training_epochs)),
+                    Param("batch_size", str(self.training_batch_size)),
+                ],
+            )
+
         self.logger.info(
             "Fold %d - train_loss: %f - train_accuracy: %f",
             self.fold,
@@ -257,10 +446,13 @@ class Training(Pipeline):
 
         self.logger.info("Evaluating fold %d...", self.fold)
 
-        # Let's evaluate the model using the test data we processed before.
+        # Let's evaluate the model using the test data we processed before. The test
+        # data of a fold is small, so we can evaluate it in a single batch. This runs
+        # the compiled evaluation function only once instead of once per batch.
         self.test_loss, self.test_accuracy = self.model.evaluate(
             self.x_test,
             self.y_test,
+            batch_size=len(self.x_test),
             verbose=0,
         )
 
@@ -297,11 +489,15 @@ class Training(Pipeline):
         # from the incoming branches to make `mlflow_run_id` available.
         self.merge_artifacts(inputs, include=["mlflow_run_id"])
 
-        # Let's calculate the mean and standard deviation of the accuracy and loss from
-        # all the cross-validation folds.
-        metrics = [[i.test_accuracy, i.test_loss] for i in inputs]
-        self.test_accuracy, self.test_loss = np.mean(metrics, axis=0)
-        self.test_accuracy_std, self.test_loss_std = np.std(metrics, axis=0)
+        # Let's collect the accuracy and loss from all the cross-validation folds in a
+        # single array with one row per fold, and calculate their mean and standard
+        # deviation.
+        metrics = np.fromiter(
+            (value for i in inputs for value in (i.test_accuracy, i.test_loss)),
+            dtype=np.float64,
+        ).reshape(-1, 2)
+        self.test_accuracy, self.test_loss = metrics.mean(axis=0)
+        self.test_accuracy_std, self.test_loss_std = metrics.std(axis=0)
 
         self.logger.info("Accuracy: %f ±%f", self.test_accuracy, self.test_accuracy_std)
         self.logger.info("Loss: %f ±%f", self.test_loss, self.test_loss_std)
@@ -322,41 +518,30 @@ class Training(Pipeline):
         self.next(self.register)
 
     @card
-    @step
-    def transform(self):
-        """Apply the transformation pipeline to the entire dataset.
-
-        We'll use the entire dataset to build the final model, so we need to transform
-        the dataset before training.
-
-        We want to store the transformers as artifacts so we can later use them
-        to transform the input data during inference.
-        """
-        # Let's build the SciKit-Learn pipeline and transform the dataset features.
-        self.features_transformer = build_features_transformer()
-        self.x = self.features_transformer.fit_transform(self.data)
-
-        # Let's build the SciKit-Learn pipeline and transform the target column.
-        self.target_transformer = build_target_transformer()
-        self.y = self.target_transformer.fit_transform(self.data)
-
-        # Now that we have transformed the data, we can train the final model.
-        self.next(self.train)
-
-    @card
+    @resources(gpu=config_expr("project.gpu"))
     @environment(vars=environment_variables)
     @step
     def train(self):
-        """Train the final model using the entire dataset."""
+        """Train the final model using the entire dataset.
+
+        This step will request the number of GPUs specified in the project
+        configuration. Keras will automatically use them if the backend supports it.
+        """
         import mlflow
 
-        self.logger.info("Training final model...")
+        device = get_training_device() or "the default device"
+        self.logger.info("Training final model on %s...", device)
 
         # Let's log the training process under the current MLflow run.
         with mlflow.start_run(run_id=self.mlflow_run_id):
             # We want to log the model manually, so let's disable automatic logging.
             mlflow.autolog(log_models=False)
 
+            # We don't want the training process to wait for the tracking server
+            # every time it logs something, so let's send every request in the
+            # background. MLflow will flush any pending requests when the run ends.
+            mlflow.config.enable_async_logging()
+
             # Let's now build and fit the model on the entire dataset.
             self.model = build_model(self.x.shape[1])
             self.model.fit(
@@ -390,13 +575,25 @@ class Training(Pipeline):
         # `accuracy_threshold` parameter.
         if self.test_accuracy >= self.accuracy_threshold:
             self.registered = True
+
+            # If requested, we'll quantize the weights of the model before packaging
+            # it. This doesn't require retraining the model.
+            if self.quantize:
+                self.logger.info("Quantizing model to int8...")
+                self.model.quantize("int8")
+
             self.logger.info("Registering model...")
 
             # We'll register the model under the current MLflow run. We also need to
-            # create a temporary directory to store the model artifacts.
+            # create a temporary directory to store the model artifacts. MLflow expects
+            # the artifacts to be files, so we'll create the directory in shared memory
+            # when it's available to avoid writing them to disk before uploading them.
+            shared_memory = Path("/dev/shm")  # noqa: S108
             with (
                 mlflow.start_run(run_id=self.mlflow_run_id),
-                tempfile.TemporaryDirectory() as directory,
+                tempfile.TemporaryDirectory(
+                    dir=shared_memory if shared_memory.is_dir() else None
+                ) as directory,
             ):
                 self.artifacts = self._get_model_artifacts(directory)
                 self.pip_requirements = self._get_model_pip_requirements()
@@ -414,6 +611,9 @@ class Training(Pipeline):
                     code_paths=self.code_paths,
                     artifacts=self.artifacts,
                     pip_requirements=self.pip_requirements,
+                    # We don't need to wait for the new model version to be ready
+                    # before finishing the step.
+                    await_registration_for=0,
                 )
 
         else:
@@ -433,12 +633,32 @@ class Training(Pipeline):
         """End the Training pipeline."""
         self.logger.info("The pipeline finished successfully.")
 
+    def _get_transformers_cache(self):
+        """Return the cache used to store the results of the transformation process.
+
+        The cache key includes the unfitted transformers we pass to the cached
+        functions, and we store the results in a separate directory for every version
+        of Scikit-Learn. If the `transformers_cache` parameter is empty or the flow is
+        running in production mode, the returned cache will not store anything and
+        every call will execute the transformation process.
+        """
+        import sklearn
+        from joblib import Memory
+
+        if not self.transformers_cache or current.is_production:
+            return Memory(location=None, verbose=0)
+
+        location = Path(self.transformers_cache) / f"scikit-learn-{sklearn.__version__}"
+        return Memory(location=location, verbose=0)
+
     def _get_model_artifacts(self, directory: str):
         """Return the list of artifacts that will be included with model.
 
         The model must preprocess the raw input data before making a prediction, so we
         need to include the Scikit-Learn transformers as part of the model package.
         """
+        from concurrent.futures import ThreadPoolExecutor
+
         import joblib
 
         # Let's start by saving the model inside the supplied directory.
@@ -446,11 +666,30 @@ class Training(Pipeline):
         self.model.save(model_path)
 
         # We also want to save the Scikit-Learn transformers so we can package them
-        # with the model and use them during inference.
+        # with the model and use them during inference. We'll compress them to reduce
+        # the size of the artifacts we need to upload, and save them in parallel.
         features_transformer_path = (Path(directory) / "features.joblib").as_posix()
         target_transformer_path = (Path(directory) / "target.joblib").as_posix()
-        joblib.dump(self.features_transformer, features_transformer_path)
-        joblib.dump(self.target_transformer, target_transformer_path)
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            futures = [
+                executor.submit(
+                    joblib.dump,
+                    self.features_transformer,
+                    features_transformer_path,
+                    compress=3,
+                ),
+                executor.submit(
+                    joblib.dump,
+                    self.target_transformer,
+                    target_transformer_path,
+                    compress=3,
+                ),
+            ]
+
+            # Let's wait for both transformers to be saved. This will raise any
+            # exception that happened while saving them.
+            for future in futures:
+                future.result()
 
         return {
             "model": model_path,
@@ -459,20 +698,18 @@ class Training(Pipeline):
         }
 
     def _get_model_pip_requirements(self):
-        """Return the list of required packages to run the model in production."""
-        import keras
-        import numpy as np
-        import pandas as pd
-        import sklearn
-        import tensorflow as tf
-
-        return [
-            f"scikit-learn=={sklearn.__version__}",
-            f"pandas=={pd.__version__}",
-            f"numpy=={np.__version__}",
-            f"keras=={keras.__version__}",
-            f"tensorflow=={tf.__version__}",
-        ]
+        """Return the list of required packages to run the model in production.
+
+        We read the version of every package from its installed metadata instead of
+        importing it, so we don't need to load libraries like TensorFlow just to find
+        out which version is installed. We include both JAX and TensorFlow because the
+        model will use whichever backend the `KERAS_BACKEND` environment variable
+        specifies when serving it.
+        """
+        from importlib.metadata import version
+
+        packages = ["scikit-learn", "pandas", "numpy", "keras", "jax", "tensorflow"]
+        return [f"{package}=={version(package)}" for package in packages]
 
 
 if __name__ == "__main__":
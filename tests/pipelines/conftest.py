@@ -18,7 +18,7 @@ def training_run(mlflow_directory):
         show_output=False,
     ).run(
         mlflow_tracking_uri=mlflow_directory,
-        training_epochs=1,
+        training_epochs=2,
         accuracy_threshold=0.1,
     ) as running:
         return running.run
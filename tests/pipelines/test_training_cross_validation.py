@@ -1,4 +1,58 @@
+import numpy as np
+import pytest
+from metaflow import Runner
+
+from pipelines.training import split_fold
+
+
 def test_cross_validation_creates_5_folds(training_run):
     data = training_run["cross_validation"].task.data
     cross_validation_folds = 5
     assert len(data.folds) == cross_validation_folds
+
+
+def test_split_fold_uses_permutation_slice_as_test_data():
+    permutation = np.array([4, 2, 0, 3, 1, 5], dtype=np.int32)
+    boundaries = np.array([0, 2, 4, 6], dtype=np.int32)
+
+    train_indices, test_indices = split_fold(permutation, boundaries, 1)
+
+    assert list(test_indices) == [0, 3]
+    assert list(train_indices) == [4, 2, 1, 5]
+
+
+def test_cross_validation_folds_cover_the_dataset(training_run):
+    data = training_run["cross_validation"].task.data
+
+    test_indices = np.concatenate(
+        [
+            split_fold(data.fold_permutation, data.fold_boundaries, fold)[1]
+            for fold in data.folds
+        ]
+    )
+
+    assert sorted(test_indices) == list(range(len(data.data)))
+
+
+@pytest.mark.integration
+def test_cross_validation_slices_transformed_dataset_if_leak_ok(mlflow_directory):
+    with Runner(
+        "src/pipelines/training.py",
+        show_output=False,
+    ).run(
+        mlflow_tracking_uri=mlflow_directory,
+        training_epochs=1,
+        accuracy_threshold=0.1,
+        leak_ok=True,
+    ) as running:
+        data = running.run["cross_validation"].task.data
+
+        for fold in data.folds:
+            train_indices, test_indices = split_fold(
+                data.fold_permutation, data.fold_boundaries, fold
+            )
+            x_train, y_train, x_test, y_test = data.fold_data[fold]
+            assert x_train.shape == (len(train_indices), 9)
+            assert y_train.shape == (len(train_indices), 1)
+            assert x_test.shape == (len(test_indices), 9)
+            assert y_test.shape == (len(test_indices), 1)
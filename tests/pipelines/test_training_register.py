@@ -30,6 +30,27 @@ def test_register_registers_model_if_accuracy_above_threshold(mlflow_directory):
         assert data.registered is True, "Model should have been registered"
 
 
+@pytest.mark.integration
+def test_register_quantizes_model_if_requested(mlflow_directory):
+    with Runner(
+        "src/pipelines/training.py",
+        show_output=False,
+    ).run(
+        mlflow_tracking_uri=mlflow_directory,
+        training_epochs=1,
+        accuracy_threshold=0.0001,
+        quantize=True,
+    ) as running:
+        data = running.run["register"].task.data
+        dense_layers = [layer for layer in data.model.layers if layer.weights]
+        assert all(layer.quantization_mode == "int8" for layer in dense_layers)
+
+
+def test_register_doesnt_quantize_model_by_default(training_run):
+    data = training_run["register"].task.data
+    assert all(layer.quantization_mode is None for layer in data.model.layers)
+
+
 def test_register_pip_requirements(training_run):
     import pandas as pd
 
@@ -37,6 +58,17 @@ def test_register_pip_requirements(training_run):
     assert f"pandas=={pd.__version__}" in data.pip_requirements
 
 
+def test_register_pip_requirements_pin_installed_versions(training_run):
+    import jax
+    import keras
+    import sklearn
+
+    data = training_run["register"].task.data
+    assert f"keras=={keras.__version__}" in data.pip_requirements
+    assert f"scikit-learn=={sklearn.__version__}" in data.pip_requirements
+    assert f"jax=={jax.__version__}" in data.pip_requirements
+
+
 def test_register_artifacts(training_run):
     data = training_run["register"].task.data
 
@@ -1,6 +1,7 @@
+import keras
 from keras import optimizers
 
-from pipelines.training import build_model
+from pipelines.training import build_model, get_training_device
 
 
 def test_build_model_configures_input_layer_correctly():
@@ -31,11 +32,26 @@ def test_build_model_configures_optimizer_correctly():
     assert model.optimizer.learning_rate == learning_rate
 
 
+def test_build_model_compiles_model_with_xla():
+    model = build_model(input_shape=9)
+    assert model.jit_compile is True
+
+
 def test_build_model_loss_function():
     model = build_model(input_shape=9)
     assert model.loss == "sparse_categorical_crossentropy"
 
 
+def test_get_training_device_returns_device_name():
+    assert get_training_device()
+
+
+def test_get_training_device_ignores_backends_without_devices(monkeypatch):
+    # Keras doesn't support listing devices with backends like PyTorch or NumPy.
+    monkeypatch.setattr(keras.backend, "backend", lambda: "torch")
+    assert get_training_device() is None
+
+
 def test_train_fold_builds_model(training_run):
     data = training_run["train_fold"].task.data
     assert data.model is not None
@@ -46,6 +62,32 @@ def test_train_fold_creates_mlflow_nested_run(training_run):
     assert data.mlflow_fold_run_id is not None
 
 
+def test_train_fold_logs_final_training_metrics(training_run, mlflow_directory):
+    from mlflow import MlflowClient
+
+    data = training_run["train_fold"].task.data
+    client = MlflowClient(tracking_uri=mlflow_directory)
+
+    # The flow trains every fold for more than one epoch, but we only want to log
+    # the final value of every metric.
+    run = client.get_run(data.mlflow_fold_run_id)
+    assert int(run.data.params["epochs"]) > 1
+
+    for key in ["loss", "accuracy"]:
+        history = client.get_metric_history(data.mlflow_fold_run_id, key)
+        assert len(history) == 1
+        assert history[0].step == 0
+
+
 def test_train_stores_model_as_artifact(training_run):
     data = training_run["train"].task.data
     assert data.model is not None
+
+
+def test_train_logs_training_metrics(training_run, mlflow_directory):
+    from mlflow import MlflowClient
+
+    data = training_run["train"].task.data
+    client = MlflowClient(tracking_uri=mlflow_directory)
+
+    assert client.get_metric_history(data.mlflow_run_id, "loss")
@@ -1,8 +1,15 @@
+import numpy as np
 import pandas as pd
 import pytest
+from joblib import Memory
 from sklearn.preprocessing import OrdinalEncoder
 
-from pipelines.training import build_features_transformer, build_target_transformer
+from pipelines.training import (
+    build_features_transformer,
+    build_target_transformer,
+    transform_data,
+    transform_fold_data,
+)
 
 
 @pytest.fixture(scope="module")
@@ -75,13 +82,88 @@ def test_target_transformer_returns_correct_number_of_columns(data):
     ), "Unexpected output shape after transforming the target column"
 
 
-def test_transform_fold_sets_fold_index(training_run):
-    data = training_run["transform_fold"].task.data
+def test_transform_data_returns_fitted_transformers(data):
+    features_transformer, target_transformer, x, y = transform_data(
+        data,
+        build_features_transformer(),
+        build_target_transformer(),
+    )
+
+    assert x.shape == (len(data), 9)
+    assert y.shape == (len(data), 1)
+    assert x.dtype == np.float32
+    assert y.dtype == np.int32
+    assert list(target_transformer.transformers_[0][1].categories_[0]) == [
+        "Adelie",
+        "Chinstrap",
+        "Gentoo",
+    ]
+    assert features_transformer.transform(data).shape == x.shape
+
+
+def test_transform_data_cache_depends_on_transformers(data, tmp_path):
+    transform = Memory(location=tmp_path, verbose=0).cache(transform_data)
+    _, _, x, _ = transform(
+        data, build_features_transformer(), build_target_transformer()
+    )
+
+    # If we change the definition of the transformers, the cached result of the
+    # original transformers shouldn't be reused.
+    features_transformer = build_features_transformer().set_params(categorical="drop")
+    _, _, x_numeric, _ = transform(
+        data, features_transformer, build_target_transformer()
+    )
+
+    numeric_columns = 4
+    assert x.shape[1] > numeric_columns
+    assert x_numeric.shape[1] == numeric_columns
+
+
+def test_transform_fold_data_fits_transformers_on_training_data(data):
+    # Let's add a Chinstrap penguin from Torgersen so the training split contains
+    # every species but never sees the Dream island of the penguin in the test split.
+    data = pd.concat(
+        [data, data.iloc[[2]].assign(island="Torgersen")],
+        ignore_index=True,
+    )
+    x_train, y_train, x_test, y_test = transform_fold_data(
+        data,
+        [0, 1, 3],
+        [2],
+        build_features_transformer(),
+        build_target_transformer(),
+    )
+
+    # The transformers only learn the 4 numeric columns, the 2 islands, and the 2
+    # sexes from the training split.
+    numeric_columns = 4
+    encoded_columns = numeric_columns + 2 + 2
+    assert x_train.shape == (3, encoded_columns)
+    assert y_train.shape == (3, 1)
+    assert x_test.shape == (1, encoded_columns)
+    assert y_test.shape == (1, 1)
+
+    # The numeric columns are scaled using statistics from the training split only,
+    # and the unknown island of the test split is encoded as an all-zero vector.
+    np.testing.assert_allclose(x_train[:, :numeric_columns].mean(axis=0), 0, atol=1e-6)
+    assert not x_test[0, numeric_columns : numeric_columns + 2].any()
+
+    assert x_train.dtype == x_test.dtype == np.float32
+    assert y_train.dtype == y_test.dtype == np.int32
+
+
+def test_cross_validation_transforms_every_fold(training_run):
+    data = training_run["cross_validation"].task.data
+    assert len(data.fold_data) == len(data.folds)
+
+
+def test_train_fold_sets_fold_index(training_run):
+    data = training_run["train_fold"].task.data
     assert data.fold in range(5)
 
 
-def test_transform_fold_processes_data_splits(training_run):
-    data = training_run["transform_fold"].task.data
+def test_train_fold_processes_data_splits(training_run):
+    data = training_run["train_fold"].task.data
 
     train_size = len(data.train_indices)
     test_size = len(data.test_indices)
@@ -94,7 +176,7 @@ def test_transform_fold_processes_data_splits(training_run):
 
 
 def test_transform_processes_dataset(training_run):
-    data = training_run["transform"].task.data
+    data = training_run["start"].task.data
 
     dataset_size = len(data.data)
 
@@ -103,7 +185,7 @@ def test_transform_processes_dataset(training_run):
 
 
 def test_transform_stores_transformation_pipelines_as_artifacts(training_run):
-    data = training_run["transform"].task.data
+    data = training_run["start"].task.data
 
     assert data.features_transformer is not None
     assert data.target_transformer is not None